@@ -0,0 +1,81 @@
+import logging
+from typing import Sequence
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import calinski_harabasz_score, silhouette_score
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveKMeans:
+    """
+    KMeans that picks its number of clusters from a small candidate set.
+
+    BERTopic fits it once on the reduced embeddings. Each candidate k is
+    scored by silhouette (rescaled to [0, 1]) plus Calinski-Harabasz
+    (normalized by the best candidate) and the highest total wins, so a
+    fixed k cannot force small threads into degenerate clusters.
+    """
+
+    def __init__(
+            self,
+            candidates: Sequence[int] = (2, 3, 5, 8, 10),
+            random_state: int = 42,
+            minibatch_threshold: int = 2048,
+            silhouette_sample_size: int = 2000
+    ):
+        self.candidates = candidates
+        self.random_state = random_state
+        self.minibatch_threshold = minibatch_threshold
+        self.silhouette_sample_size = silhouette_sample_size
+
+    def _make_model(self, k: int, n_samples: int):
+        # Mini-batches only pay off once there is more than one batch of documents
+        if n_samples >= self.minibatch_threshold:
+            return MiniBatchKMeans(n_clusters=k, random_state=self.random_state, n_init=3,
+                                   batch_size=1024, max_iter=100)
+        return KMeans(n_clusters=k, random_state=self.random_state, n_init=1)
+
+    def _candidate_ks(self, n_samples: int):
+        # Keep at least ~3 documents per cluster on average
+        ks = sorted(k for k in set(self.candidates) if 2 <= k <= n_samples // 3)
+        return ks or [min(2, n_samples)]
+
+    def fit(self, X, y=None):
+        X = np.asarray(X)
+        n_samples = X.shape[0]
+        ks = self._candidate_ks(n_samples)
+
+        fitted = []
+        for k in ks:
+            model = self._make_model(k, n_samples).fit(X)
+            labels = model.labels_
+            if len(ks) == 1 or len(np.unique(labels)) < 2:
+                fitted.append((k, model, None, None))
+                continue
+            silhouette = silhouette_score(
+                X, labels,
+                sample_size=min(n_samples, self.silhouette_sample_size),
+                random_state=self.random_state
+            )
+            fitted.append((k, model, silhouette, calinski_harabasz_score(X, labels)))
+
+        scored = [f for f in fitted if f[2] is not None]
+        if scored:
+            max_ch = max(f[3] for f in scored) or 1.0
+            best = max(scored, key=lambda f: (f[2] + 1) / 2 + f[3] / max_ch)
+        else:
+            best = fitted[0]
+
+        self.n_clusters_ = best[0]
+        self.model_ = best[1]
+        self.labels_ = self.model_.labels_
+        logger.info(f"AdaptiveKMeans chose k={self.n_clusters_} from candidates {ks}")
+        return self
+
+    def predict(self, X):
+        return self.model_.predict(X)
+
+    def fit_predict(self, X, y=None):
+        return self.fit(X).labels_
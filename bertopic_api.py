@@ -1,102 +1,108 @@
+import os
+
+
+def physical_core_count():
+    """Best-effort physical core count (falls back to logical CPUs)"""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    return cores or os.cpu_count() or 1
+
+
+# One inference thread budget shared by torch and ONNX Runtime: the physical cores split
+# across worker processes (WEB_CONCURRENCY, as gunicorn reads it). OMP_NUM_THREADS overrides.
+# OpenMP reads this when torch/numpy first load, so it has to be set before those imports
+OMP_NUM_THREADS_FROM_ENV = "OMP_NUM_THREADS" in os.environ
+INFERENCE_THREADS = int(os.environ.get("OMP_NUM_THREADS") or max(
+    1, physical_core_count() // max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))))
+os.environ.setdefault("OMP_NUM_THREADS", str(INFERENCE_THREADS))
+# Lets torch.cuda.is_available() below ask NVML instead of initializing the CUDA runtime,
+# which must not happen in a gunicorn master that later forks workers
+os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import numpy as np
 import openai
 from sentence_transformers import SentenceTransformer
-from umap import UMAP
-from hdbscan import HDBSCAN
 from bertopic import BERTopic
+from bertopic.representation import KeyBERTInspired
 # from bertopic.representation import OpenAI as BertopicOpenAI
-from openai_representation import StableOpenAIRepresentation
+from openai_representation import StableOpenAIRepresentation, openai_retry
+from embedding_cache import CachedEncoder, CachedEmbeddingBackend
+from semantic_cache import SemanticCache
+from filelock import FileLock
 
 import logging
-from copy import deepcopy
+from copy import copy
 from transformers import pipeline, AutoModelForCausalLM, AutoTokenizer
 import torch
-import json
+import atexit
+import hashlib
+import orjson
+import queue
+import shutil
 import sys
+import tempfile
+import threading
 
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-MIN_LENGTH = 12        # Below this BERTopic breaks
-MAX_LENGTH = 3000      # Prevent oversized OpenAI prompts
+# CPU inference tuning: intra-op threads from the shared budget, oneDNN kernels enabled
+torch.set_num_threads(INFERENCE_THREADS)
+torch.set_num_interop_threads(2)
+torch.backends.mkldnn.enabled = True
 
-def normalize_text(text):
-    """Remove control characters and normalize basic punctuation."""
-    if not isinstance(text, str):
-        return ""
-    # Remove strange control chars
-    text = re.sub(r"[\x00-\x1F\x7F]", " ", text)
-    return text.strip()
-
-def pad_short_text(text):
-    """BERTopic triggers errors with very short documents, so pad them."""
-    if len(text) >= MIN_LENGTH:
-        return text
-    if len(text) == 0:
-        return ""
-    # Pad by repetition to reach safe length
-    needed = MIN_LENGTH - len(text)
-    return text + " " + text[:needed]
-
-def truncate_long_text(text):
-    """Cap document length to keep OpenAI prompt sizes in check."""
-    if len(text) <= MAX_LENGTH:
-        return text
-    return text[:MAX_LENGTH]
 
+def set_inference_threads(workers):
+    """Resize the thread budget to this process's share of the physical cores (called after fork)"""
+    global INFERENCE_THREADS
+    if OMP_NUM_THREADS_FROM_ENV:
+        return  # The operator's explicit setting wins
+    INFERENCE_THREADS = max(1, physical_core_count() // max(1, workers))
+    torch.set_num_threads(INFERENCE_THREADS)
 
-def clean_comments(comments):
-    """Clean and validate comments for BERTopic processing with detailed logging"""
-    print("\n=== Starting comment cleaning ===")
-    print(f"Initial comments count: {len(comments)}")
+EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-    cleaned = []
-    for i, c in enumerate(comments):
-        print(f"\nProcessing comment {i}:")
-        print(f"Original type: {type(c)}, length: {len(str(c)) if c else 0}")
-
-        if not c:
-            print("Skipping empty comment")
-            continue
-
-        # Ensure it's a string
-        text = str(c) if not isinstance(c, str) else c
-        print(f"After string conversion - length: {len(text)}")
-
-        # Normalize and clean the text
-        text = normalize_text(text)
-        print(f"After normalization - length: {len(text)}")
+MIN_LENGTH = 12        # Below this BERTopic breaks
+MAX_LENGTH = 3000      # Prevent oversized OpenAI prompts
 
-        if not text.strip():
-            print("Skipping empty text after normalization")
-            continue
+_CTRL_RE = re.compile(r"[\x00-\x1F\x7F]")
 
-        # Ensure minimum and maximum length requirements
-        orig_length = len(text)
-        text = pad_short_text(text)
-        if len(text) > orig_length:
-            print(f"Padded text from {orig_length} to {len(text)} characters")
 
-        text = truncate_long_text(text)
-        if len(text) < orig_length:
-            print(f"Truncated text from {orig_length} to {len(text)} characters")
+def clean_comments(comments):
+    """Clean and validate comments for BERTopic processing"""
+    # Normalize, dropping comments that are empty before or after normalization
+    stripped = [
+        t for t in (_CTRL_RE.sub(" ", c if isinstance(c, str) else str(c)).strip() for c in comments if c)
+        if t
+    ]
+    # BERTopic breaks on very short documents, so pad them by repetition;
+    # cap the rest to keep OpenAI prompt sizes in check
+    cleaned = [
+        (t if len(t) >= MIN_LENGTH else (t + " " + t)[:MIN_LENGTH + 1])[:MAX_LENGTH]
+        for t in stripped
+    ]
 
-        cleaned.append(text)
-        print(f"Added to cleaned comments. Current count: {len(cleaned)}")
+    logger.info(f"Cleaned {len(cleaned)}/{len(comments)} comments")
 
     # Ensure we have at least 3 documents (BERTopic minimum)
     if len(cleaned) < 3:
-        print(f"\nWarning: Only {len(cleaned)} valid comments found. Adding placeholders.")
+        logger.warning(f"Only {len(cleaned)} valid comments found. Adding placeholders.")
         while len(cleaned) < 3:
-            placeholder = f"placeholder document {len(cleaned)}"
-            print(f"Adding placeholder: {placeholder}")
-            cleaned.append(placeholder)
+            cleaned.append(f"placeholder document {len(cleaned)}")
 
-    print(f"\n=== Finished cleaning ===\nTotal valid comments: {len(cleaned)}")
-    print("Sample of cleaned comments:")
-    for i, c in enumerate(cleaned[:3]):  # Show first 3 samples
-        print(f"{i + 1}. {c[:100]}{'...' if len(c) > 100 else ''}")
+    if logger.isEnabledFor(logging.DEBUG):
+        n_padded = sum(len(t) < MIN_LENGTH for t in stripped)
+        n_truncated = sum(len(t) > MAX_LENGTH for t in stripped)
+        logger.debug(f"Padded {n_padded}, truncated {n_truncated} comments")
+        for i, c in enumerate(cleaned[:3]):  # Show first 3 samples
+            logger.debug(f"Sample {i + 1}: {c[:100]}{'...' if len(c) > 100 else ''}")
 
     return cleaned
 
@@ -128,129 +134,380 @@ model_cache = {
     'summarizer': None
 }
 
+# e.g. "sentence-transformers/paraphrase-multilingual-mpnet-base-v2" for multilingual threads
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# int8 weights shipped in the model repo, quantized for AVX-512 VNNI kernels
+ONNX_MODEL_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+EMBEDDING_MAX_SEQ_LENGTH = 128
+# CPU backend: "onnx" (int8, the default) or "torch" (fp32, whose weights can be shared across fork)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "onnx")
+
+
+def export_quantized_onnx_model(model_name):
+    """
+    Export `model_name` to ONNX and apply dynamic int8 quantization, once.
+    Returns the local model directory, which holds ONNX_MODEL_FILE.
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    export_dir = os.path.join(ONNX_EXPORT_DIR, model_name.replace("/", "__"))
+    os.makedirs(ONNX_EXPORT_DIR, exist_ok=True)
+    # Every worker warms up at once: one exports while the others wait, and the
+    # export is built in a scratch directory so a crash never leaves a partial model
+    with FileLock(export_dir + ".lock"):
+        if not os.path.exists(os.path.join(export_dir, ONNX_MODEL_FILE)):
+            logger.info(f"Quantizing {model_name} to int8 ONNX in {export_dir} (one-time)...")
+            tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=ONNX_EXPORT_DIR)
+            try:
+                fp32_model = SentenceTransformer(model_name, backend="onnx")
+                fp32_model.save(tmp_dir)
+                export_dynamic_quantized_onnx_model(fp32_model, "avx512_vnni", tmp_dir)
+                shutil.rmtree(export_dir, ignore_errors=True)
+                os.replace(tmp_dir, export_dir)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+    return export_dir
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL):
+    """
+    Load a SentenceTransformer: fp16 PyTorch on CUDA when a GPU is present,
+    otherwise EMBEDDING_BACKEND on CPU, with ONNX falling back to PyTorch
+    """
+    if EMBEDDING_DEVICE == "cuda":
+        model = SentenceTransformer(model_name, device="cuda").half()
+        logger.info(f"Loaded {model_name} on CUDA (fp16)")
+        return configure_embedding_model(model, model_name)
+
+    if EMBEDDING_BACKEND == "torch":
+        model = SentenceTransformer(model_name)
+        logger.info(f"Loaded {model_name} with PyTorch backend")
+        return configure_embedding_model(model, model_name)
+
+    try:
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = INFERENCE_THREADS
+
+        model_kwargs = {
+            "file_name": ONNX_MODEL_FILE,
+            "provider": "CPUExecutionProvider",
+            "session_options": sess_options
+        }
+        try:
+            model = SentenceTransformer(model_name, backend="onnx", model_kwargs=model_kwargs)
+        except Exception as e:
+            # The model repo ships no quantized file; quantize a local export instead
+            logger.info(f"No {ONNX_MODEL_FILE} published for {model_name} ({e})")
+            model = SentenceTransformer(
+                export_quantized_onnx_model(model_name), backend="onnx", model_kwargs=model_kwargs
+            )
+        logger.info(f"Loaded {model_name} with ONNX backend ({ONNX_MODEL_FILE})")
+    except Exception as e:
+        logger.warning(f"ONNX backend unavailable for {model_name}: {e}. Using PyTorch backend.")
+        model = SentenceTransformer(model_name)
+    return configure_embedding_model(model, model_name)
+
+
+def configure_embedding_model(model, model_name):
+    """Apply inference settings shared by every embedding backend"""
+    # encode() tokenizes each comment once with this tokenizer; the length cap
+    # bounds attention cost on long comments (MiniLM was trained on 128 tokens)
+    model.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+    model.eval()
+    if not getattr(model.tokenizer, "is_fast", False):
+        logger.warning(f"{model_name} is using a slow (pure Python) tokenizer")
+    return model
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(CACHE_DIR, "embeddings"))
+SEMANTIC_CACHE_DIR = os.environ.get("SEMANTIC_CACHE_DIR", os.path.join(CACHE_DIR, "semantic"))
+ONNX_EXPORT_DIR = os.environ.get("ONNX_EXPORT_DIR", os.path.join(CACHE_DIR, "onnx"))
+
+
+def embedding_variant(model):
+    """Backend and precision of a loaded model; int8, fp16 and fp32 vectors differ slightly"""
+    if model.get_backend() == "onnx":
+        return "onnx-qint8"
+    param = next(model.parameters())
+    return f"torch-{param.device.type}-{str(param.dtype).replace('torch.', '')}"
+
+
+model_cache_lock = threading.Lock()
+
 
 def get_embedding_model():
     """Get or create the embedding model"""
     if model_cache['embedding'] is None:
-        logger.info("Loading embedding model...")
-        model_cache['embedding'] = SentenceTransformer("sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+        with model_cache_lock:
+            if model_cache['embedding'] is None:
+                logger.info("Loading embedding model...")
+                model_cache['embedding'] = load_embedding_model()
     return model_cache['embedding']
 
 
+def get_embedding_cache():
+    """Get or create the per-comment embedding cache, keyed to the loaded model variant"""
+    if model_cache.get('embedding_cache') is None:
+        model = get_embedding_model()
+        with model_cache_lock:
+            if model_cache.get('embedding_cache') is None:
+                model_cache['embedding_cache'] = CachedEncoder(
+                    f"{EMBEDDING_MODEL}@{EMBEDDING_MAX_SEQ_LENGTH}/{embedding_variant(model)}",
+                    cache_dir=EMBEDDING_CACHE_DIR,
+                    max_entries=10000
+                )
+    return model_cache['embedding_cache']
+
+
+def preload_for_fork():
+    """
+    Prepare a pre-fork master: share fork-safe model weights and close inherited resources.
+    Only PyTorch CPU weights are safe to carry across fork: CUDA contexts and ONNX Runtime
+    sessions are not, so those backends are never loaded here and each worker loads its own.
+    """
+    # SQLite connections must not cross fork; the disk cache reconnects on first use
+    if model_cache.get('embedding_cache') is not None:
+        model_cache['embedding_cache'].close()
+
+    if EMBEDDING_DEVICE != "cpu" or EMBEDDING_BACKEND != "torch":
+        logger.info(f"Embedding backend ({EMBEDDING_BACKEND} on {EMBEDDING_DEVICE}) is not fork-safe; "
+                    f"each worker loads its own copy")
+        return
+    model = get_embedding_model()
+    for param in model.parameters():
+        param.share_memory_()
+    logger.info("Embedding model weights loaded into shared memory before fork")
+
+
+def warmup():
+    """Load the embedding model and run a throwaway encode so the first request doesn't pay for it"""
+    model = get_embedding_model()
+    with torch.inference_mode():
+        model.encode(["warmup"] * 4, batch_size=4, show_progress_bar=False)
+    logger.info("Embedding model warmed up")
+
+
+def embed_for_cache(texts):
+    """
+    Embed semantic cache keys (normalized, so inner product is cosine).
+    Each line of a key is embedded on its own and the vectors averaged: a key
+    spans far more than the encoder's 128-token window, and a single pass
+    would only see its first line or two (e.g. a recurring thread title).
+    """
+    model = get_embedding_model()
+    vectors = []
+    for text in texts:
+        lines = [line for line in text.split("\n") if line.strip()] or [text]
+        vector = model.encode(
+            lines, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True
+        ).mean(axis=0)
+        vectors.append(vector / (np.linalg.norm(vector) or 1.0))
+    return np.vstack(vectors)
+
+
+def get_response_cache(name):
+    """Get or create the semantic OpenAI response cache called `name`"""
+    caches = model_cache.setdefault('response_caches', {})
+    if name not in caches:
+        dim = get_embedding_model().get_sentence_embedding_dimension()
+        with model_cache_lock:
+            if name not in caches:
+                caches[name] = SemanticCache(
+                    embed_for_cache,
+                    dim=dim,
+                    # Vectors from different embedding models are not comparable
+                    index_path=os.path.join(
+                        SEMANTIC_CACHE_DIR,
+                        f"{name}-{EMBEDDING_MODEL.replace('/', '__')}@{EMBEDDING_MAX_SEQ_LENGTH}.faiss"
+                    ),
+                    threshold=0.95
+                )
+    return caches[name]
+
+
+@atexit.register
+def save_response_caches():
+    """Persist semantic response caches on shutdown"""
+    for cache in model_cache.get('response_caches', {}).values():
+        try:
+            cache.save()
+        except Exception as e:
+            logger.error(f"Failed to save semantic cache {cache.index_path}: {e}")
+
+
 from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
+from adaptive_kmeans import AdaptiveKMeans
+
+try:
+    # RAPIDS GPU implementation with the same fit/transform API
+    from cuml.decomposition import PCA as cuPCA
+    CUML_AVAILABLE = True
+except ImportError:
+    CUML_AVAILABLE = False
+
+MINIBATCH_KMEANS_MIN_DOCS = 2048
+MIN_DOCS_FOR_KEYBERT = 50
+
+# KeyBERTInspired keeps no per-call state, so one instance serves every request
+keybert_representation = KeyBERTInspired()
 from sentence_transformers import SentenceTransformer
 
 
 # Update the create_bertopic_model function
-def create_bertopic_model(openai_api_key=None):
+def create_bertopic_model(openai_api_key=None, n_docs=None):
     """
-    Create and return a BERTopic model with simplified configuration
-    Returns: tuple of (topic_model, embedding_model)
+    Create and return a BERTopic model with simplified configuration.
+    The embedding model is shared across requests; PCA, KMeans and BERTopic
+    are cheap to build and hold per-request fitted state, so they are fresh each call.
+    `n_docs` caps the number of PCA components for very small threads.
+    Returns: tuple of (topic_model, embedding_backend)
     """
-    # Step 1: Create embedding model - using a smaller, faster model
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    # Step 1: Get the shared embedding model - using a smaller, faster model (int8 ONNX)
+    embedding_model = get_embedding_model()
 
-    # Step 2: Use PCA for dimensionality reduction (faster than UMAP)
-    umap_model = PCA(n_components=5, random_state=42)
+    # Step 2: Use randomized PCA for dimensionality reduction (faster than UMAP and full SVD);
+    # centering matters: normalized sentence embeddings share a large mean direction that
+    # would otherwise take up one of the five components
+    n_components = 5 if n_docs is None else max(1, min(5, n_docs - 1))
+    if EMBEDDING_DEVICE == "cuda" and CUML_AVAILABLE:
+        umap_model = cuPCA(n_components=n_components, output_type='numpy')
+    else:
+        umap_model = PCA(n_components=n_components, svd_solver='randomized', iterated_power=4, random_state=42)
 
-    # Step 3: Use KMeans for clustering (more stable than HDBSCAN)
-    hdbscan_model = KMeans(n_clusters=5, random_state=42, n_init=10)
+    # Step 3: Use KMeans for clustering (more stable than HDBSCAN), choosing k per thread
+    hdbscan_model = AdaptiveKMeans(random_state=42, minibatch_threshold=MINIBATCH_KMEANS_MIN_DOCS)
 
     # Step 4: Create BERTopic model
+    # Route BERTopic's own embedding calls (e.g. KeyBERT's representative docs) through the cache too
+    embedding_backend = CachedEmbeddingBackend(
+        get_embedding_cache(),
+        embedding_model,
+        batch_size=64,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+
     topic_model = BERTopic(
-        embedding_model=embedding_model,
+        embedding_model=embedding_backend,
         umap_model=umap_model,
         hdbscan_model=hdbscan_model,
         language="english",
-        calculate_probabilities=True,
-        verbose=True
+        calculate_probabilities=False,  # probs from fit_transform are never used
+        verbose=False
     )
 
-    return topic_model, embedding_model
+    return topic_model, embedding_backend
+
+
+# Attributes BERTopic.update_topics reassigns; clustering state and weights are untouched
+TOPIC_STATE_ATTRS = (
+    'topic_representations_',
+    'topic_labels_',
+    'topic_aspects_',
+    'topic_embeddings_',
+    'topic_sizes_',
+    'c_tf_idf_',
+    'vectorizer_model',
+    'ctfidf_model',
+    'representation_model',
+    'top_n_words'
+)
 
 
-# Update the update_topics_with_huggingface function
-def update_topics_with_huggingface(topic_model, comments):
-    """Update topic representations using a simpler Hugging Face model"""
-    try:
-        logger.info("Updating topics with Hugging Face...")
-        updated_model = deepcopy(topic_model)
+def snapshot_topic_state(topic_model):
+    """Capture the representation state so a failed update_topics can be rolled back"""
+    # Shallow copies: update_topics rebinds these rather than mutating them, except for
+    # the dicts, which are cheap to copy and could be updated in place
+    return {
+        attr: copy(value) if isinstance(value, dict) else value
+        for attr, value in ((a, getattr(topic_model, a, None)) for a in TOPIC_STATE_ATTRS)
+    }
 
-        # Use a simpler, faster model for representation
-        representation_model = {
-            "model": "all-MiniLM-L6-v2",  # Same as our embedding model
-            "exponent_scale": 0.9,
-            "word_length": 10  # Shorter word length for faster processing
-        }
 
-        # Update model with Hugging Face representation
-        updated_model.update_topics(
-            comments,
-            representation_model=representation_model
-        )
-        logger.error(f"Hugging Face Update Done")
-        return updated_model, "Hugging Face (MiniLM)"
-    except Exception as e:
-        logger.error(f"Hugging Face update failed: {e}")
-        return topic_model, "Basic BERTopic (no enhancement)"
+def restore_topic_state(topic_model, state):
+    """Roll a model back to a snapshot taken by snapshot_topic_state"""
+    for attr, value in state.items():
+        setattr(topic_model, attr, value)
 
 
 def update_topics_with_openai(topic_model, comments, openai_api_key):
+    state = snapshot_topic_state(topic_model)
     try:
         logger.info("Updating topics with stable OpenAI model...")
 
-        comments = clean_comments(comments)
-        updated_model = deepcopy(topic_model)
-
         openai_rep = StableOpenAIRepresentation(
             api_key=openai_api_key,
             model="gpt-3.5-turbo",
-            max_len=300,
-            batch_size=8
+            max_tokens=256,
+            response_cache=get_response_cache('topic_labels')
         )
 
-        updated_model.update_topics(
+        topic_model.update_topics(
             comments,
             representation_model=openai_rep
         )
 
-        return updated_model, "OpenAI"
+        return topic_model, "OpenAI"
 
     except Exception as e:
         logger.error(f"OpenAI update failed: {e}")
+        restore_topic_state(topic_model, state)
         logger.info("Falling back to Hugging Face model...")
         return update_topics_with_huggingface(topic_model, comments)
 
 
 def update_topics_with_huggingface(topic_model, comments):
     """Update topic representations using a simpler Hugging Face model"""
+    # KeyBERT re-embeds candidate words; on small or near-single-topic threads
+    # the c-TF-IDF words from fit_transform are just as good
+    # KMeans assigns no outlier topic, but don't count -1 if a clusterer does
+    n_topics = len(set(topic_model.topics_) - {-1})
+    if len(comments) < MIN_DOCS_FOR_KEYBERT or n_topics <= 1:
+        logger.info(f"Skipping KeyBERT update ({len(comments)} comments, {n_topics} topics)")
+        return topic_model, f"Basic BERTopic (skipped: N<{MIN_DOCS_FOR_KEYBERT} or k<=1)"
+
+    state = snapshot_topic_state(topic_model)
     try:
         logger.info("Updating topics with Hugging Face...")
-        updated_model = deepcopy(topic_model)
-
-        from bertopic.representation import KeyBERTInspired
-
-        representation_model = KeyBERTInspired()
 
         # Pass documents to update_topics
-        updated_model.update_topics(
+        topic_model.update_topics(
             comments,
-            representation_model=representation_model
+            representation_model=keybert_representation
         )
 
         logger.info("Hugging Face update completed successfully")
-        logger.info(f"Updated model has topics_: {hasattr(updated_model, 'topics_')}")
-        return updated_model, "Hugging Face (KeyBERT)"
+        logger.info(f"Updated model has topics_: {hasattr(topic_model, 'topics_')}")
+        return topic_model, "Hugging Face (KeyBERT)"
 
     except Exception as e:
         logger.error(f"Hugging Face update failed: {e}")
+        restore_topic_state(topic_model, state)
         logger.info("Falling back to basic BERTopic model")
         return topic_model, "Basic BERTopic (no enhancement)"
 
 
 import openai
 
+# Exact-match summary LRU in front of the semantic cache: skips embedding the prompt on repeats
+SUMMARY_CACHE_SIZE = 1024
+summary_cache = OrderedDict()
+summary_cache_lock = threading.Lock()
+
+
+def remember_summary(prompt_hash, summary):
+    with summary_cache_lock:
+        summary_cache[prompt_hash] = summary
+        summary_cache.move_to_end(prompt_hash)
+        while len(summary_cache) > SUMMARY_CACHE_SIZE:
+            summary_cache.popitem(last=False)
+
+
 def generate_overall_summary(topics, openai_api_key, post_title):
     """Generate an overall summary of the topics using OpenAI"""
     try:
@@ -279,8 +536,29 @@ Main Discussion Topics:
 
 Summary:"""
 
+        # The prompt is built only from the top topics and the title, so its hash keys exact repeats
+        prompt_hash = hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+        with summary_cache_lock:
+            cached_summary = summary_cache.get(prompt_hash)
+            if cached_summary is not None:
+                summary_cache.move_to_end(prompt_hash)
+        if cached_summary is not None:
+            logger.info("Returning cached summary for an identical prompt")
+            return cached_summary
+
+        # Key the semantic cache on the variable part only; the fixed instructions would
+        # dominate the embedding (and its 128-token window)
+        cache_key = f"{post_title}\n{topics_text}"
+        response_cache = get_response_cache('summary')
+        cached_summary = response_cache.get(cache_key)
+        if cached_summary is not None:
+            logger.info("Returning cached summary for a semantically matching prompt")
+            remember_summary(prompt_hash, cached_summary)
+            return cached_summary
+
         logger.info("Sending request to OpenAI API for summary generation...")
-        response = openai.ChatCompletion.create(
+        client = openai.OpenAI(api_key=openai_api_key, max_retries=0)
+        response = openai_retry(client.chat.completions.create)(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a helpful assistant that summarizes Reddit discussions."},
@@ -290,7 +568,9 @@ Summary:"""
             temperature=0.7
         )
 
-        summary = response.choices[0].message['content'].strip()
+        summary = response.choices[0].message.content.strip()
+        response_cache.add(cache_key, summary)
+        remember_summary(prompt_hash, summary)
         logger.info(f"Summary generated successfully. Length: {len(summary)} characters.")
         return summary
     except Exception as e:
@@ -310,15 +590,67 @@ def health_check():
     })
 
 
+@lru_cache(maxsize=64)
 def send_progress_update(message, progress=None):
-    """Helper function to format progress updates"""
+    """Helper function to format progress updates (pre-serialized, the set of messages is fixed)"""
     update = {
         'status': 'progress',
         'message': message,
         'progress': progress if progress is not None else 0
     }
     # Ensure we return a single JSON object per line
-    return json.dumps(update) + '\n\n'
+    return orjson.dumps(update) + b'\n\n'
+
+
+def stream_in_background(events, heartbeat_interval=5.0, maxsize=16):
+    """
+    Run a chunk-producing generator on a worker thread and stream its output.
+
+    The heavy pipeline steps block between yields for minutes; draining a
+    bounded queue here lets the response re-send the latest progress line
+    as a heartbeat while the worker is busy.
+    """
+    chunks = queue.Queue(maxsize=maxsize)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for chunk in events:
+                if not put(chunk):
+                    break
+        finally:
+            events.close()
+            put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    last_chunk = None
+    try:
+        while True:
+            try:
+                chunk = chunks.get(timeout=heartbeat_interval)
+            except queue.Empty:
+                # Only progress lines precede the sentinel, so this repeats progress
+                if last_chunk is not None:
+                    yield last_chunk
+                continue
+            if chunk is done:
+                return
+            last_chunk = chunk
+            yield chunk
+    finally:
+        # Client went away (or we finished); let the worker stop at its next step
+        cancelled.set()
 
 
 @app.route('/analyze', methods=['POST', 'OPTIONS'])
@@ -345,7 +677,7 @@ def analyze_reddit_post():
         data = request.get_json()
         if not data:
             return Response(
-                json.dumps({'status': 'error', 'error': 'No JSON data received'}),
+                orjson.dumps({'status': 'error', 'error': 'No JSON data received'}),
                 status=400,
                 mimetype='application/json'
             )
@@ -356,7 +688,7 @@ def analyze_reddit_post():
 
         if not comments:
             return Response(
-                json.dumps({'status': 'error', 'error': 'No comments to analyze'}),
+                orjson.dumps({'status': 'error', 'error': 'No comments to analyze'}),
                 status=400,
                 mimetype='application/json'
             )
@@ -364,85 +696,86 @@ def analyze_reddit_post():
         def generate_analysis():
             try:
                 yield send_progress_update('Loading models...', 10)
-                topic_model, embedding_model = create_bertopic_model(openai_api_key)
+                # Model loading is mostly I/O and native code, so comment cleaning overlaps with it
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    fut_model = executor.submit(get_embedding_model)
+                    fut_clean = executor.submit(clean_comments, comments)
+                    fut_model.result()
+                    documents = fut_clean.result()
+                # Cheap once the embedding model is loaded; sized to the cleaned thread
+                topic_model, embedding_backend = create_bertopic_model(openai_api_key, n_docs=len(documents))
                 logger.info("Models loaded successfully")
 
                 yield send_progress_update('Embedding comments...', 30)
-                embeddings = embedding_model.encode(comments, show_progress_bar=False)
+                with torch.inference_mode(), torch.autocast(
+                        "cuda", dtype=torch.float16, enabled=EMBEDDING_DEVICE == "cuda"):
+                    embeddings = embedding_backend.embed(documents)
                 logger.info(f"Embeddings created. Shape: {embeddings.shape}")
 
                 yield send_progress_update('Analyzing topics...', 70)
-                topics, probs = topic_model.fit_transform(comments, embeddings)
+                topics, _ = topic_model.fit_transform(documents, embeddings)
+
+                # Inspect the assignments once; update_topics only changes representations,
+                # so these stay valid (and equal to topic_model.topics_) for the rest of the request
+                raw_topics = np.asarray(topics)
+                if raw_topics.dtype == bool or raw_topics.ndim != 1:
+                    logger.error(f"Invalid topics array: dtype={raw_topics.dtype}, shape={raw_topics.shape}")
+                    raise ValueError("Topics array has invalid dtype or shape")
+                topics_array = raw_topics.astype(np.int32, copy=False)
+                unique_topics = np.unique(topics_array)
                 logger.info(
-                    f"Topic analysis complete. Topics shape: {np.array(topics).shape}, unique topics: {len(np.unique(topics))}")
+                    f"Topic analysis complete. Topics shape: {topics_array.shape}, unique topics: {unique_topics.size}")
 
                 yield send_progress_update('Processing topic information...', 80)
-                logger.info(f"Initial topics type: {type(topics)}, dtype: {getattr(topics, 'dtype', 'N/A')}")
 
                 model_used = "None"
                 if openai_api_key:
                     yield send_progress_update('Enhancing with OpenAI...', 85)
-                    topic_model, model_used = update_topics_with_openai(topic_model, comments, openai_api_key)
+                    topic_model, model_used = update_topics_with_openai(topic_model, documents, openai_api_key)
                     logger.info(f"OpenAI enhancement complete. Model used: {model_used}")
                 else:
                     yield send_progress_update('Enhancing with Hugging Face...', 85)
-                    topic_model, model_used = update_topics_with_huggingface(topic_model, comments)
+                    topic_model, model_used = update_topics_with_huggingface(topic_model, documents)
                     logger.info(f"Hugging Face enhancement complete. Model used: {model_used}")
 
                 yield send_progress_update('Finalizing results...', 90)
-                logger.info(f"Model has topics_ attribute: {hasattr(topic_model, 'topics_')}")
-
-                if hasattr(topic_model, 'topics_') and topic_model.topics_ is not None:
-                    topics_array = np.array(topic_model.topics_)
-                    logger.info(f"Using model.topics_. Shape: {topics_array.shape}, dtype: {topics_array.dtype}")
-                elif isinstance(topics, (list, np.ndarray)):
-                    topics_array = np.array(topics) if isinstance(topics, list) else topics
-                    logger.info(f"Using original topics. Shape: {topics_array.shape}, dtype: {topics_array.dtype}")
-                else:
-                    logger.error(
-                        f"Unable to extract topics. topics type: {type(topics)}, topics_: {getattr(topic_model, 'topics_', 'N/A')}")
-                    raise ValueError("Failed to extract valid topics array from model")
-
-                logger.info(
-                    f"Topics array validation - dtype: {topics_array.dtype}, ndim: {topics_array.ndim}, shape: {topics_array.shape}")
-
-                if topics_array.dtype == bool or topics_array.ndim == 0:
-                    logger.error(f"Invalid topics_array: dtype={topics_array.dtype}, shape={topics_array.shape}")
-                    raise ValueError("Topics array has invalid dtype or shape")
-
-                logger.info("Topics array validation passed")
                 topic_info = topic_model.get_topic_info()
                 logger.info(f"Retrieved topic info. Total topics: {len(topic_info)}")
-
-                topics_list = []
-
-                for idx, row in topic_info.iterrows():
-                    topic_id = int(row['Topic'])
-                    if topic_id == -1:
-                        logger.debug(f"Skipping outlier topic (id: {topic_id})")
-                        continue
-                    words = row['Representation'][:5] if isinstance(row['Representation'], list) else []
-
-                    try:
-                        if isinstance(topics_array, np.ndarray) and topics_array.ndim > 0:
-                            percentage = round((topics_array == topic_id).sum() / len(topics_array) * 100, 2)
-                            logger.debug(f"Topic {topic_id}: calculated percentage {percentage}%")
-                        else:
-                            total_topics = len(topic_info) - 1
-                            percentage = round(100 / total_topics, 2) if total_topics > 0 else 0
-                            logger.debug(f"Topic {topic_id}: using equal distribution {percentage}%")
-                    except Exception as e:
-                        logger.warning(
-                            f"Failed to calculate percentage for topic {topic_id}: {e}. Using equal distribution.")
-                        total_topics = len(topic_info) - 1
-                        percentage = round(100 / total_topics, 2) if total_topics > 0 else 0
-
-                    topics_list.append({
+                # Drop the outlier topic (-1)
+                topic_info = topic_info[topic_info['Topic'] != -1].reset_index(drop=True)
+                topic_ids = topic_info['Topic'].to_numpy(dtype=np.intp)
+
+                # Count every topic in one pass; outliers (-1) still count toward the total
+                topic_counts = np.bincount(topics_array[topics_array >= 0], minlength=topic_ids.max(initial=-1) + 1)
+                total_docs = topics_array.size
+                if total_docs > 0:
+                    percentages = np.round(topic_counts[topic_ids] * 100.0 / total_docs, 2)
+                else:
+                    percentages = np.full(topic_ids.size, round(100 / topic_ids.size, 2) if topic_ids.size else 0)
+
+                # Representation models may pad their word lists with empty strings
+                words_per_topic = [
+                    [w for w in rep if w] if isinstance(rep, list) else []
+                    for rep in topic_info['Representation']
+                ]
+                # The OpenAI representation leads with its label, followed by the c-TF-IDF words
+                llm_labelled = model_used == "OpenAI"
+                labels = [
+                    (words[0] if llm_labelled else ', '.join(words[:5])) if words else f'Topic {topic_id}'
+                    for topic_id, words in zip(topic_ids.tolist(), words_per_topic)
+                ]
+                if llm_labelled:
+                    words_per_topic = [words[1:] for words in words_per_topic]
+                topics_list = [
+                    {
                         'id': topic_id,
-                        'label': ', '.join(words) if words else f'Topic {topic_id}',
-                        'words': words,
+                        'label': label,
+                        'words': words[:5],
                         'percentage': percentage
-                    })
+                    }
+                    for topic_id, label, words, percentage in zip(
+                        topic_ids.tolist(), labels, words_per_topic, percentages.tolist())
+                ]
 
                 logger.info(f"Topics list created with {len(topics_list)} topics")
 
@@ -462,27 +795,27 @@ def analyze_reddit_post():
                     'summary': summary,
                     'total_comments': len(comments)
                 }
-                yield json.dumps(result) + '\n\n'
+                yield orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n\n'
 
             except Exception as e:
                 import traceback
                 error_trace = traceback.format_exc()
                 logger.error(f"Analysis error: {str(e)}\n{error_trace}")
-                yield json.dumps({
+                yield orjson.dumps({
                     'status': 'error',
                     'error': str(e),
                     'traceback': error_trace
-                }) + '\n\n'
+                }) + b'\n\n'
 
         # Set response headers for streaming
-        return Response(generate_analysis(), mimetype='text/event-stream')
+        return Response(stream_in_background(generate_analysis()), mimetype='text/event-stream')
 
     except Exception as e:
         import traceback
         error_trace = traceback.format_exc()
         logger.error(f"Request processing error: {str(e)}\n{error_trace}")
         return Response(
-            json.dumps({
+            orjson.dumps({
                 'status': 'error',
                 'error': str(e),
                 'traceback': error_trace
@@ -504,6 +837,10 @@ def add_cors_headers(response):
 if __name__ == '__main__':
     # Pre-load models on startup
     logger.info("Starting BERTopic API server...")
-    # Initialize models
-    # get_embedding_model()
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # Initialize models once, before any worker thread can race to load them
+    warmup()
+
+    # Production WSGI server; for multiple processes use
+    #   gunicorn -w 4 -k gthread --threads 4 bertopic_api:app
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5001, threads=8)
@@ -0,0 +1,136 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import diskcache
+import numpy as np
+from bertopic.backend import BaseEmbedder
+
+logger = logging.getLogger(__name__)
+
+
+class CachedEncoder:
+    """
+    Per-comment embedding cache: an in-memory LRU in front of a disk cache.
+
+    Entries are keyed by (model_name, sha1(normalized text)) so repeated
+    comments skip the embedding forward pass entirely. Vectors are stored
+    as float16 to halve the cache footprint and upcast to float32 on read.
+    """
+
+    def __init__(
+            self,
+            model_name: str,
+            cache_dir: str,
+            max_entries: int = 10000
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(cache_dir)
+        logger.info(f"Embedding cache ready - model: {model_name}, dir: {cache_dir}")
+
+    def close(self):
+        """Close the disk cache's database connection; it reopens on next use (e.g. after fork)"""
+        self._disk.close()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(str(text).split())
+
+    def _hash(self, text: str) -> str:
+        return hashlib.sha1(self._normalize(text).encode("utf-8")).hexdigest()
+
+    def _get(self, key: str):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                return vector
+
+        vector = self._disk.get((self.model_name, key))
+        if vector is not None:
+            self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def find_uncached_texts(self, texts: List[str]) -> Tuple[List[str], List[int], dict]:
+        """Return (keys, indices of cache misses, {index: cached vector} for hits)"""
+        keys = [self._hash(t) for t in texts]
+        hits = {}
+        misses = []
+        for i, key in enumerate(keys):
+            vector = self._get(key)
+            if vector is None:
+                misses.append(i)
+            else:
+                hits[i] = vector
+        return keys, misses, hits
+
+    def encode(self, model, texts: List[str], batch_size: int = 64, **encode_kwargs) -> np.ndarray:
+        """
+        Embed texts with `model`, running the forward pass only on cache misses.
+
+        Misses are encoded in length-sorted batches written straight into one
+        pre-allocated float32 buffer, which is also the returned array.
+        """
+        keys, misses, hits = self.find_uncached_texts(texts)
+        logger.info(f"Embedding cache: {len(hits)} hits, {len(misses)} misses")
+
+        embeddings = np.empty((len(texts), model.get_sentence_embedding_dimension()), dtype=np.float32)
+        for i, vector in hits.items():
+            embeddings[i] = vector  # float16 -> float32
+
+        if misses:
+            # Encode each distinct missing text once
+            first_index = {}
+            for i in misses:
+                first_index.setdefault(keys[i], i)
+
+            # Sort by length across all batches so each batch pads to similar lengths
+            order = sorted(first_index.values(), key=lambda i: len(texts[i]))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                embeddings[batch] = model.encode(
+                    [texts[i] for i in batch], batch_size=batch_size, **encode_kwargs
+                )
+
+            for i in misses:
+                source = first_index[keys[i]]
+                if source != i:
+                    embeddings[i] = embeddings[source]
+            # One SQLite transaction for the whole batch instead of one commit per vector
+            with self._disk.transact():
+                for key, i in first_index.items():
+                    vector = embeddings[i].astype(np.float16)
+                    self._remember(key, vector)
+                    self._disk.set((self.model_name, key), vector)
+
+        return embeddings
+
+
+class CachedEmbeddingBackend(BaseEmbedder):
+    """
+    BERTopic embedding backend that routes every encode through a CachedEncoder.
+
+    Documents embedded once for fit_transform (and words embedded by
+    KeyBERTInspired) are then served from the cache when BERTopic's
+    representation models ask for them again.
+    """
+
+    def __init__(self, cache: CachedEncoder, model, **encode_kwargs):
+        super().__init__(embedding_model=model)
+        self.cache = cache
+        self.encode_kwargs = encode_kwargs
+
+    def embed(self, documents: List[str], verbose: bool = False) -> np.ndarray:
+        return self.cache.encode(self.embedding_model, list(documents), **self.encode_kwargs)
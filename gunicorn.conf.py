@@ -0,0 +1,35 @@
+# gunicorn picks this file up automatically from the working directory.
+import os
+
+bind = "0.0.0.0:5001"
+# Topic modeling is CPU-bound and can run for minutes on large threads
+timeout = 600
+# Only the CPU PyTorch backend gains from importing the app in the master: its weights are
+# shared copy-on-write. ONNX Runtime sessions and CUDA contexts don't survive fork, so with
+# those each worker imports the app and loads the model itself
+preload_app = os.environ.get("EMBEDDING_BACKEND", "onnx") == "torch"
+
+
+def when_ready(server):
+    # Master process, after the app is loaded and before any worker is forked:
+    # shares PyTorch CPU weights and closes the embedding cache's SQLite connection
+    if server.cfg.preload_app:
+        from bertopic_api import preload_for_fork
+        preload_for_fork()
+
+
+def post_fork(server, worker):
+    # Give each worker its share of the physical cores, however the worker count was set.
+    # Without preloading the app isn't imported yet (and must not be before gevent patches),
+    # so it picks the count up from WEB_CONCURRENCY at import
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+    if server.cfg.preload_app:
+        from bertopic_api import set_inference_threads
+        set_inference_threads(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    # Runs once the worker has imported the app (after gevent patching, if used),
+    # so the first /analyze request doesn't pay for model loading
+    from bertopic_api import warmup
+    warmup()
@@ -1,19 +1,41 @@
+import asyncio
 import openai
-import numpy as np
 from typing import List
 import logging
+import tiktoken
+from bertopic.representation import BaseRepresentation
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 logger = logging.getLogger(__name__)
 
 
-class StableOpenAIRepresentation:
+def gevent_patched() -> bool:
+    """True inside a gevent worker (see wsgi.py), where threading is monkey-patched"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+# Back off and retry rate limits and dropped connections; clients using this
+# should pass max_retries=0 so the SDK's own retries don't multiply with these
+openai_retry = retry(
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError)),
+    wait=wait_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(5),
+    reraise=True
+)
+
+
+class StableOpenAIRepresentation(BaseRepresentation):
     def __init__(
             self,
             api_key: str,
             model: str = "gpt-3.5-turbo",
-            embedding_model: str = "text-embedding-ada-002",
-            max_len: int = 400,
-            batch_size: int = 5,
+            max_tokens: int = 256,
+            nr_docs: int = 4,
+            max_concurrency: int = 16,
+            response_cache=None,
             **kwargs
     ):
         logger.info(f"Initializing StableOpenAIRepresentation - model: {model}")
@@ -22,71 +44,149 @@ class StableOpenAIRepresentation:
         if kwargs:
             logger.warning(f"Ignoring unexpected kwargs: {list(kwargs.keys())}")
 
-        try:
-            # Set the OpenAI API key
-            openai.api_key = api_key
-            logger.info("OpenAI API key set successfully")
-        except Exception as e:
-            logger.error(f"Failed to set OpenAI API key: {e}")
-            raise
-
+        # Passed to each client rather than set on the openai module, which concurrent requests share
+        self.api_key = api_key
         self.model = model
-        self.embedding_model = embedding_model
-        self.max_len = max_len
-        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        # Truncate by model tokens rather than characters
+        try:
+            self._encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self._encoding = tiktoken.get_encoding("cl100k_base")
+        self.nr_docs = nr_docs
+        self.max_concurrency = max_concurrency
+        # Optional SemanticCache of topic keywords + representative documents -> label
+        self.response_cache = response_cache
 
     def _clean(self, text: str) -> str:
+        """Clean a document and cap it at `max_tokens` tokens"""
         if not isinstance(text, str):
-            return "empty document"
+            text = "empty document"
         text = text.strip()
         if len(text) == 0:
-            return "empty document"
-        if len(text) > self.max_len:
-            return text[:self.max_len]
-        if len(text) < 10:
-            return text + " " + text
+            text = "empty document"
+        elif len(text) < 10:
+            text = text + " " + text
+        ids = self._encoding.encode(text)
+        if len(ids) > self.max_tokens:
+            ids = ids[:self.max_tokens]
+            text = self._encoding.decode(ids)
         return text
 
-    def embed_documents(self, documents: List[str]) -> np.ndarray:
-        logger.info(f"Embedding {len(documents)} documents")
-        cleaned_docs = [self._clean(d) for d in documents]
-        embeddings = []
-
-        for i in range(0, len(cleaned_docs), self.batch_size):
-            batch = cleaned_docs[i:i + self.batch_size]
-            logger.debug(f"Processing embedding batch {i // self.batch_size + 1}")
-            try:
-                response = openai.Embedding.create(
-                    model=self.embedding_model,
-                    input=batch
-                )
-                for item in response['data']:
-                    embeddings.append(item['embedding'])
-            except Exception as e:
-                logger.error(f"Failed to create embeddings: {e}")
-                raise
-
-        logger.info(f"Embeddings created successfully: {len(embeddings)} vectors")
-        return np.array(embeddings)
+    def _join_docs(self, docs: List[str]) -> str:
+        return "\n".join(self._clean(d) for d in docs)
 
-    def __call__(self, docs: List[str]) -> List[str]:
-        logger.info(f"Generating topic representation from {len(docs)} documents")
-        cleaned_docs = [self._clean(d) for d in docs]
-        joined_text = "\n".join(cleaned_docs)
-
-        prompt = (
+    def _build_prompt(self, joined_text: str) -> str:
+        return (
             "Summarize the core theme of these documents to create a short topic label: "
             f"\n{joined_text}\n"
         )
 
+    @staticmethod
+    def _cache_key(doc_text: str, topic_keywords: str) -> str:
+        # Key on the topic's keywords and documents, not the shared instruction text;
+        # documents alone collide when topics share a bot reply or quoted post
+        return f"{topic_keywords}\n{doc_text}" if topic_keywords else doc_text
+
+    def _cached_label(self, cache_key: str):
+        return self.response_cache.get(cache_key) if self.response_cache is not None else None
+
+    def _remember_label(self, cache_key: str, text: str):
+        if self.response_cache is not None:
+            self.response_cache.add(cache_key, text)
+
+    async def _generate_labels(self, doc_texts: List[str], keywords: List[str]) -> List[str]:
+        """Label each joined document text concurrently, at most `max_concurrency` requests in flight"""
+        client = openai.AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        @openai_retry
+        async def complete(prompt: str) -> str:
+            async with semaphore:
+                response = await client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            return response.choices[0].message.content.strip()
+
+        async def label(doc_text: str, topic_keywords: str) -> str:
+            cache_key = self._cache_key(doc_text, topic_keywords)
+            cached = self._cached_label(cache_key)
+            if cached is not None:
+                return cached
+            text = await complete(self._build_prompt(doc_text))
+            self._remember_label(cache_key, text)
+            return text
+
         try:
-            response = openai.ChatCompletion.create(
+            return await asyncio.gather(*[label(t, k) for t, k in zip(doc_texts, keywords)])
+        finally:
+            await client.close()
+
+    def _generate_labels_gevent(self, doc_texts: List[str], keywords: List[str]) -> List[str]:
+        """Same as _generate_labels, on greenlets: the sync client cooperates through patched sockets"""
+        from gevent.pool import Pool
+
+        client = openai.OpenAI(api_key=self.api_key, max_retries=0)
+
+        @openai_retry
+        def complete(prompt: str) -> str:
+            response = client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}]
             )
-            label = response['choices'][0]['message']['content'].strip()
+            return response.choices[0].message.content.strip()
+
+        def label(args) -> str:
+            doc_text, topic_keywords = args
+            cache_key = self._cache_key(doc_text, topic_keywords)
+            cached = self._cached_label(cache_key)
+            if cached is not None:
+                return cached
+            text = complete(self._build_prompt(doc_text))
+            self._remember_label(cache_key, text)
+            return text
+
+        try:
+            return Pool(self.max_concurrency).map(label, list(zip(doc_texts, keywords)))
+        finally:
+            client.close()
+
+    def _label_all(self, doc_texts: List[str], keywords: List[str] = None) -> List[str]:
+        keywords = keywords or [""] * len(doc_texts)
+        # gevent greenlets share one OS thread, and with it asyncio's running loop,
+        # so a second request's asyncio.run() would fail while the first is labelling
+        if gevent_patched():
+            return self._generate_labels_gevent(doc_texts, keywords)
+        return asyncio.run(self._generate_labels(doc_texts, keywords))
+
+    def extract_topics(self, topic_model, documents, c_tf_idf, topics):
+        """BERTopic representation hook: label every topic with one concurrent round of chat completions"""
+        repr_docs_mappings, _, _, _ = topic_model._extract_representative_docs(
+            c_tf_idf, documents, topics, 500, self.nr_docs
+        )
+        topic_ids = list(repr_docs_mappings.keys())
+        logger.info(f"Generating labels for {len(topic_ids)} topics")
+
+        try:
+            labels = self._label_all(
+                [self._join_docs(repr_docs_mappings[t]) for t in topic_ids],
+                [", ".join(word for word, _ in topics[t] if word) for t in topic_ids]
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate topic representations: {e}")
+            raise
+
+        logger.info(f"Topic labels generated: {labels}")
+        # Lead with the label and keep the c-TF-IDF words behind it as the topic's keywords
+        return {t: [(label, 1)] + list(topics[t])[:9] for t, label in zip(topic_ids, labels)}
+
+    def __call__(self, docs: List[str]) -> List[str]:
+        logger.info(f"Generating topic representation from {len(docs)} documents")
+        try:
+            label = self._label_all([self._join_docs(docs)])[0]
             logger.info(f"Topic label generated: {label}")
             return [label]
         except Exception as e:
             logger.error(f"Failed to generate topic representation: {e}")
-            raise
\ No newline at end of file
+            raise
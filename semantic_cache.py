@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, List, Optional
+
+import faiss
+import numpy as np
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Request -> response cache with nearest-neighbour lookup.
+
+    A lookup first tries an exact match on the key's hash. Otherwise keys
+    are embedded with `embed` (which must return L2-normalized vectors)
+    and searched in a FAISS inner-product index, returning the response of
+    the most similar previous key when its cosine similarity clears
+    `threshold`. Callers should key on the variable part of a prompt only;
+    shared instruction text pulls unrelated requests together. The oldest
+    entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(
+            self,
+            embed: Callable[[List[str]], np.ndarray],
+            dim: int,
+            index_path: str,
+            threshold: float = 0.95,
+            max_entries: int = 2048
+    ):
+        self.embed = embed
+        self.dim = dim
+        self.index_path = index_path
+        self.entries_path = index_path + ".entries.json"
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Entries added since load; save() merges them into whatever other processes wrote
+        self._pending = []
+
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        with FileLock(self.index_path + ".lock"):
+            self.index, self.entries = self._load()
+        if self.entries:
+            logger.info(f"Loaded semantic cache with {len(self.entries)} entries from {self.index_path}")
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        """Read the saved index and [key hash, response] entries, or start empty if missing or inconsistent"""
+        if os.path.exists(self.index_path) and os.path.exists(self.entries_path):
+            index = faiss.read_index(self.index_path)
+            with open(self.entries_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if index.d == self.dim and index.ntotal == len(entries):
+                return index, entries
+            logger.warning(f"Discarding semantic cache {self.index_path}: dimension {index.d} "
+                           f"(expected {self.dim}), {index.ntotal} vectors for {len(entries)} entries")
+        return faiss.IndexFlatIP(self.dim), []
+
+    def _evict(self, index, entries):
+        excess = len(entries) - self.max_entries
+        if excess > 0:
+            # Flat indexes renumber the remaining ids, keeping them aligned with `entries`
+            index.remove_ids(np.arange(excess, dtype=np.int64))
+            del entries[:excess]
+
+    def _vector(self, key: str) -> np.ndarray:
+        return np.ascontiguousarray(self.embed([key]), dtype=np.float32).reshape(1, self.dim)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for this key or the closest one, or None below threshold"""
+        key_hash = self._hash(key)
+        with self._lock:
+            if not self.entries:
+                return None
+            # Newest first; at most max_entries string compares
+            for entry_hash, response in reversed(self.entries):
+                if entry_hash == key_hash:
+                    logger.info("Semantic cache hit (exact key)")
+                    return response
+
+        vector = self._vector(key)
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vector, 1)
+            score, idx = float(scores[0][0]), int(ids[0][0])
+            if idx < 0 or score < self.threshold:
+                return None
+            response = self.entries[idx][1]
+        logger.info(f"Semantic cache hit (similarity {score:.3f})")
+        return response
+
+    def add(self, key: str, response: str):
+        vector = self._vector(key)
+        entry = [self._hash(key), response]
+        with self._lock:
+            self.index.add(vector)
+            self.entries.append(entry)
+            self._evict(self.index, self.entries)
+            self._pending.append((vector, entry))
+            del self._pending[:-self.max_entries]
+
+    def save(self):
+        """Merge new entries into the saved cache and replace the files atomically"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        # Every worker saves at exit; the lock and re-read keep one from dropping another's entries
+        with FileLock(self.index_path + ".lock"):
+            index, entries = self._load()
+            index.add(np.vstack([vector for vector, _ in pending]))
+            entries.extend(entry for _, entry in pending)
+            self._evict(index, entries)
+
+            suffix = f".{os.getpid()}.tmp"
+            faiss.write_index(index, self.index_path + suffix)
+            with open(self.entries_path + suffix, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(self.entries_path + suffix, self.entries_path)
+            os.replace(self.index_path + suffix, self.index_path)
+        logger.info(f"Saved semantic cache with {len(entries)} entries to {self.index_path}")
@@ -0,0 +1,17 @@
+"""
+Entrypoint for gunicorn with gevent workers:
+
+    gunicorn -k gevent -w 2 --worker-connections 1000 wsgi:app
+
+Patching has to happen before bertopic_api (and with it requests/ssl/socket)
+is imported, so blocking OpenAI HTTP calls yield to other greenlets; topic
+labelling switches to greenlets instead of asyncio here. Embedding and
+clustering are CPU-bound and still block the worker's event loop, so the
+README recommends gthread workers. Running `python bertopic_api.py` directly
+stays unpatched.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from bertopic_api import app  # noqa: E402